@@ -6,6 +6,7 @@ from referencias.models import Caja, Referencia
 class CajaAdmin(admin.ModelAdmin):
     list_display = ['referencia', 'ancho_cm', 'alto_cm', 'profundidad_cm', 'ancho_2d_mm', 'alto_2d_mm']
     list_filter = ['referencia']
+    ordering = ['referencia', 'ancho_cm', 'alto_cm']
     readonly_fields = ['ancho_2d_mm', 'alto_2d_mm']
     fields = [
         'referencia',
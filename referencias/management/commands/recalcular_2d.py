@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from referencias.models import Caja
+
+
+class Command(BaseCommand):
+    help = "Recalcula el ancho y alto en 2D de las cajas a partir de su PDF."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="IDs de las cajas (por defecto, todas)")
+        parser.add_argument('--workers', type=int, default=8, help="PDFs analizados en paralelo")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers debe ser al menos 1")
+
+        queryset = Caja.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+
+        actualizadas, fallidas = Caja.objects.recalcular_ancho_alto_2d(queryset, max_workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(f"{actualizadas} cajas actualizadas"))
+        for pk, error in fallidas:
+            self.stderr.write(self.style.ERROR(f"Caja {pk}: {error}"))
+        if fallidas:
+            self.stderr.write(self.style.ERROR(f"{len(fallidas)} cajas no se pudieron medir"))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.25 on 2026-10-15 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referencias', '0006_rename_alto_2d_cm_caja_alto_2d_mm_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caja',
+            name='archivo_cdr_etag',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
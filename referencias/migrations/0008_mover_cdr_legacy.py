@@ -0,0 +1,44 @@
+# Generated by Django 4.2.25 on 2026-10-15 11:03
+
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.db import migrations
+
+
+def mover_cdr_legacy(apps, schema_editor):
+    """
+    Copia al storage los CDR que quedaron en <BASE_DIR>/cdr_files/, para que
+    todos los archivos se resuelvan por su nombre en el storage.
+    """
+    Caja = apps.get_model('referencias', 'Caja')
+    legacy_dir = os.path.join(str(settings.BASE_DIR), 'cdr_files')
+    if not os.path.isdir(legacy_dir):
+        return
+
+    storage = Caja._meta.get_field('archivo_cdr').storage
+    for caja in Caja.objects.exclude(archivo_cdr='').iterator():
+        name = caja.archivo_cdr.name
+        if storage.exists(name):
+            continue
+
+        legacy_path = os.path.join(legacy_dir, os.path.basename(name))
+        if not os.path.exists(legacy_path):
+            continue
+
+        with open(legacy_path, 'rb') as legacy_file:
+            saved_name = storage.save(name, File(legacy_file))
+        if saved_name != name:
+            Caja.objects.filter(pk=caja.pk).update(archivo_cdr=saved_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referencias', '0007_caja_archivo_cdr_etag'),
+    ]
+
+    operations = [
+        migrations.RunPython(mover_cdr_legacy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.25 on 2026-10-15 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referencias', '0008_mover_cdr_legacy'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='caja',
+            name='alto_2d_mm',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='caja',
+            name='ancho_2d_mm',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
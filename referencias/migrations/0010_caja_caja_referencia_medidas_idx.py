@@ -0,0 +1,17 @@
+# Generated by Django 4.2.25 on 2026-10-15 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referencias', '0009_alter_caja_alto_2d_mm_alter_caja_ancho_2d_mm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='caja',
+            index=models.Index(fields=['referencia', 'ancho_cm', 'alto_cm'], name='caja_referencia_medidas_idx'),
+        ),
+    ]
@@ -1,8 +1,108 @@
-import os
-from django.db import models
-from django.conf import settings
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.db import models, transaction
+from django.core.cache import cache
 from scripts.get_bounding_box import get_bounding_box_mm
-from .tasks import convert_cdr_to_pdf, convert_cdr_to_pdf_async
+from .tasks import start_conversion
+
+logger = logging.getLogger(__name__)
+
+# Bytes del CDR incluidos en su huella (ver _huella_archivo)
+CDR_ETAG_BYTES = 8 * 1024
+
+
+def _hash_archivo(field_file):
+    """
+    Hash del contenido de un archivo, leído por bloques desde el storage.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with field_file.open('rb') as archivo:
+        for chunk in archivo.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _huella_archivo(field_file):
+    """
+    Huella barata del contenido de un archivo: tamaño + hash de los primeros 8 KB.
+    Para un archivo recién subido se lee del upload; si no, del storage.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if field_file._committed:
+        size = field_file.storage.size(field_file.name)
+        with field_file.storage.open(field_file.name, 'rb') as archivo:
+            digest.update(archivo.read(CDR_ETAG_BYTES))
+    else:
+        upload = field_file.file
+        size = upload.size
+        upload.seek(0)
+        digest.update(upload.read(CDR_ETAG_BYTES))
+        upload.seek(0)
+    return f'{size}-{digest.hexdigest()}'
+
+
+def _medir_pdf(field_file):
+    """
+    Ancho y alto en mm del bounding box de un PDF, en caché según su contenido.
+    """
+    cache_key = f'bbox:{_hash_archivo(field_file)}'
+    return cache.get_or_set(
+        cache_key,
+        lambda: get_bounding_box_mm(field_file.path),
+        timeout=None,
+    )
+
+
+def _encolar_conversion(caja_id, cdr_file_name):
+    """
+    Encola la conversión del CDR a PDF.
+    Si el broker falla se borra la huella, así volver a subir el mismo archivo
+    la reintenta.
+    """
+    try:
+        start_conversion.delay(caja_id, cdr_file_name)
+    except Exception:
+        logger.exception("Could not queue CDR conversion for Caja %s", caja_id)
+        Caja.objects.filter(pk=caja_id).update(archivo_cdr_etag='')
+
+
+class CajaManager(models.Manager):
+    def recalcular_ancho_alto_2d(self, queryset=None, max_workers=8):
+        """
+        Recalcula el ancho y alto en 2D de varias cajas a la vez.
+        Los PDF se analizan en paralelo y los resultados se guardan con un solo
+        bulk_update, sin pasar por Caja.save(). Las cajas cuyo PDF falla se
+        omiten y se registran en el log.
+        
+        Returns:
+            tuple: (actualizadas, fallidas) - Número de cajas actualizadas y
+                   lista de (pk, error) de las que no se pudieron medir
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        cajas = list(queryset.exclude(archivo_pdf='').exclude(archivo_pdf__isnull=True))
+        
+        def medir(caja):
+            try:
+                return _medir_pdf(caja.archivo_pdf), None
+            except Exception as e:
+                logger.warning("Could not measure PDF of Caja %s", caja.pk, exc_info=True)
+                return None, e
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            resultados = list(executor.map(medir, cajas))
+        
+        medidas, fallidas = [], []
+        for caja, (medida, error) in zip(cajas, resultados):
+            if error is not None:
+                fallidas.append((caja.pk, error))
+                continue
+            caja.ancho_2d_mm, caja.alto_2d_mm = medida
+            medidas.append(caja)
+        
+        self.bulk_update(medidas, ['ancho_2d_mm', 'alto_2d_mm'])
+        return len(medidas), fallidas
 
 
 class Referencia(models.Model):
@@ -18,79 +118,107 @@ class Caja(models.Model):
     alto_cm = models.IntegerField()
     profundidad_cm = models.IntegerField()
     archivo_cdr = models.FileField(upload_to='cdr_files/')
+    archivo_cdr_etag = models.CharField(max_length=64, blank=True, editable=False)
     archivo_pdf = models.FileField(upload_to='pdf_files/', null=True, blank=True)
-    ancho_2d_mm = models.DecimalField(editable=False, blank=True, null=True, decimal_places=1, max_digits=10)
-    alto_2d_mm = models.DecimalField(editable=False, blank=True, null=True, decimal_places=1, max_digits=10)
+    ancho_2d_mm = models.FloatField(editable=False, blank=True, null=True)
+    alto_2d_mm = models.FloatField(editable=False, blank=True, null=True)
+
+    objects = CajaManager()
+
+    class Meta:
+        indexes = [
+            # Lista del admin: filtro por referencia ordenado por medidas.
+            # La FK referencia ya tiene su propio índice.
+            models.Index(fields=['referencia', 'ancho_cm', 'alto_cm'], name='caja_referencia_medidas_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Nombre del CDR en la base de datos, para detectar cambios en save()
+        loaded = dict(zip(field_names, values))
+        if loaded.get('archivo_cdr', models.DEFERRED) is not models.DEFERRED:
+            instance._cdr_name_db = loaded['archivo_cdr']
+        return instance
+
+    def _nombre_cdr_guardado(self):
+        """
+        Nombre del CDR guardado en la base de datos, o None si la fila no existe.
+        """
+        if self.pk is None:
+            return None
+        if hasattr(self, '_cdr_name_db'):
+            return self._cdr_name_db
+        return Caja.objects.filter(pk=self.pk).values_list('archivo_cdr', flat=True).first()
 
     def crear_archivo_pdf(self):
         """
         Crea el archivo PDF de la caja.
+        El PDF se guarda cuando CloudConvert notifica el webhook.
         """
         if not self.archivo_cdr:
             raise ValueError("No CDR file associated with this Caja instance")
         
-        # Try Django's FileField .path property first
-        try:
-            cdr_file_path = self.archivo_cdr.path
-            # Check if file exists at Django-expected location
-            if os.path.exists(cdr_file_path):
-                convert_cdr_to_pdf(self.pk, cdr_file_path)
-                return
-        except (ValueError, AttributeError):
-            pass
-        
-        # Fallback: try legacy location (project root cdr_files/)
-        filename = os.path.basename(self.archivo_cdr.name)
-        base_dir = getattr(settings, 'BASE_DIR', None)
-        if base_dir:
-            legacy_path = os.path.join(str(base_dir), 'cdr_files', filename)
-            if os.path.exists(legacy_path):
-                convert_cdr_to_pdf(self.pk, legacy_path)
-                return
-        
-        # If still not found, use the path property anyway (let it fail with clearer error)
-        convert_cdr_to_pdf(self.pk, self.archivo_cdr.path)
+        start_conversion(self.pk, self.archivo_cdr.name)
 
     
     def calcular_ancho_alto_2d(self):
         """
         Calcula el bounding box de la caja en 2D.
+        El resultado se guarda en caché según el contenido del PDF, así un PDF
+        sin cambios no se vuelve a analizar.
         """
         if not self.archivo_pdf:
             raise ValueError("No PDF file associated with this Caja instance")
         
-        bounding_box_width_mm, bounding_box_height_mm = get_bounding_box_mm(self.archivo_pdf.path)
-        self.ancho_2d_cm = bounding_box_width_mm
-        self.alto_2d_cm = bounding_box_height_mm
+        bounding_box_width_mm, bounding_box_height_mm = _medir_pdf(self.archivo_pdf)
+        self.ancho_2d_mm = bounding_box_width_mm
+        self.alto_2d_mm = bounding_box_height_mm
         self.save()
 
     def save(self, *args, **kwargs):
         """
         Calcula el ancho y alto en 2D de la caja.
-        Triggers async conversion of CDR to PDF via CloudConvert API.
+        Queues conversion of CDR to PDF via CloudConvert API on a Celery worker.
         """
-        # Check if this is a new instance or if the CDR file has changed
+        # Check if this is a new instance or if the CDR file content has changed.
+        # The stored fingerprint catches same-name re-uploads and ignores renames.
         is_new = self.pk is None
         cdr_changed = False
         
-        if not is_new:
-            try:
-                old_instance = Caja.objects.get(pk=self.pk)
-                # Compare by file name to detect changes
-                old_cdr_name = old_instance.archivo_cdr.name if old_instance.archivo_cdr else None
-                new_cdr_name = self.archivo_cdr.name if self.archivo_cdr else None
-                cdr_changed = old_cdr_name != new_cdr_name
-            except Caja.DoesNotExist:
-                is_new = True
+        if not self.archivo_cdr:
+            self.archivo_cdr_etag = ''
+        elif not self.archivo_cdr._committed:
+            # A new upload: compare its fingerprint with the stored one. With no
+            # PDF yet the previous conversion failed, so the same file retries it.
+            new_etag = _huella_archivo(self.archivo_cdr)
+            cdr_changed = new_etag != self.archivo_cdr_etag or not self.archivo_pdf
+            self.archivo_cdr_etag = new_etag
+        else:
+            stored_cdr_name = self._nombre_cdr_guardado()
+            name_changed = not is_new and self.archivo_cdr.name != stored_cdr_name
+            if name_changed or not self.archivo_cdr_etag:
+                # Another file already in storage, or an existing file without a
+                # fingerprint yet. A missing file gets a blank fingerprint.
+                try:
+                    new_etag = _huella_archivo(self.archivo_cdr)
+                except OSError:
+                    new_etag = ''
+                # Only a different file can trigger a conversion, not a backfill
+                cdr_changed = name_changed and (new_etag != self.archivo_cdr_etag or not self.archivo_pdf)
+                self.archivo_cdr_etag = new_etag
         
         # Save the instance first to get the ID and ensure file is saved
         super().save(*args, **kwargs)
+        self._cdr_name_db = self.archivo_cdr.name
         
         # Trigger async conversion if we have a CDR file and it's new or changed
         if self.archivo_cdr and (is_new or cdr_changed):
-            # Use Django's FileField .path property to get the absolute file path
-            cdr_file_path = self.archivo_cdr.path
-            convert_cdr_to_pdf_async(self.pk, cdr_file_path)
+            # Pass the storage name so the worker can resolve it on any backend.
+            # Queue only once the transaction commits, so the worker can see the
+            # row and a rolled-back save never starts a CloudConvert job.
+            caja_id, cdr_file_name = self.pk, self.archivo_cdr.name
+            transaction.on_commit(lambda: _encolar_conversion(caja_id, cdr_file_name))
 
     def __str__(self):
         return self.referencia.nombre + " - " + str(self.ancho_cm) + "x" + str(self.alto_cm) + "x" + str(self.profundidad_cm)
\ No newline at end of file
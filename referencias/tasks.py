@@ -1,37 +1,266 @@
 """
 Async tasks for file conversion using CloudConvert API
 """
+import asyncio
+import logging
 import os
+import tempfile
 import threading
 import time
-import requests
+import httpx
+from celery import shared_task
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files import File
 
+logger = logging.getLogger(__name__)
 
-def convert_cdr_to_pdf_async(caja_id, cdr_file_path):
+# Download chunk size: caps memory per conversion regardless of PDF size
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# CloudConvert API base URL
+API_BASE = "https://api.cloudconvert.com/v2"
+
+# Explicit per-request timeouts: 5s to connect, 30s for each read/write, so a
+# stuck connection fails fast instead of holding the worker
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+
+# Celery retry policy for network errors: exponential backoff with a factor of
+# 2, i.e. up to 2s, 4s and 8s (Celery applies full jitter by default)
+RETRY_POLICY = {
+    # The tasks only let transient errors (see _is_transient) reach Celery
+    "autoretry_for": (httpx.HTTPError,),
+    "max_retries": 3,
+    "retry_backoff": 2,
+}
+
+# Circuit breaker: after CIRCUIT_FAIL_MAX consecutive CloudConvert failures,
+# calls are skipped for CIRCUIT_RESET_TIMEOUT seconds
+CIRCUIT_FAIL_MAX = 5
+CIRCUIT_RESET_TIMEOUT = 60
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling CloudConvert while the circuit is open.
     """
-    Asynchronously convert CDR file to PDF using CloudConvert API.
+    def __init__(self, retry_after):
+        super().__init__(f"CloudConvert circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Minimal circuit breaker shared by all CloudConvert calls of this process.
+    """
+    def __init__(self, fail_max, reset_timeout):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if the circuit is open. Once the timeout has
+        passed, a single trial call goes through (half-open); the others keep
+        failing fast until it reports back.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            if self._trial_in_flight:
+                raise CircuitOpenError(self.reset_timeout)
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            if self._trial_in_flight:
+                # The trial call failed: reopen for another full timeout
+                self._trial_in_flight = False
+                self._opened_at = time.monotonic()
+                return
+            self._failures += 1
+            if self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+
+
+def _is_transient(exc):
+    """
+    True for errors worth retrying: network failures and 5xx responses.
+    4xx responses (bad request, expired URL...) will not succeed on retry.
+    """
+    if isinstance(exc, httpx.TransportError):
+        return True
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code >= 500
+
+
+_breaker = CircuitBreaker(CIRCUIT_FAIL_MAX, CIRCUIT_RESET_TIMEOUT)
+
+# Event loop and HTTP clients are kept per thread and reused across tasks, so
+# consecutive calls share pooled keep-alive connections instead of a fresh
+# TCP + TLS handshake each time.
+_local = threading.local()
+
+
+def _run(coro):
+    """
+    Run a coroutine to completion on this thread's persistent event loop.
+    """
+    loop = getattr(_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _local.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coro)
+
+
+def _client(api_key=None):
+    """
+    Shared AsyncClient for this thread, built lazily and cached by API key.
     
-    Args:
-        caja_id: ID of the Caja instance to update
-        cdr_file_path: Path to the CDR file to convert (relative to MEDIA_ROOT)
+    ``api_key=None`` returns an unauthenticated client, used for the upload
+    and download URLs that live outside the CloudConvert API.
     """
-    thread = threading.Thread(
-        target=convert_cdr_to_pdf,
-        args=(caja_id, cdr_file_path),
-        daemon=True
-    )
-    thread.start()
+    clients = getattr(_local, 'clients', None)
+    if clients is None:
+        clients = _local.clients = {}
+    
+    client = clients.get(api_key)
+    if client is None:
+        if api_key:
+            options = {"base_url": API_BASE, "headers": {"Authorization": f"Bearer {api_key}"}}
+        else:
+            options = {}
+        client = clients[api_key] = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            # Retries failed connection attempts; HTTP errors are retried by Celery
+            transport=httpx.AsyncHTTPTransport(http2=True, limits=HTTP_LIMITS, retries=3),
+            **options,
+        )
+    return client
+
+
+def _call_cloudconvert(coro):
+    """
+    Run a CloudConvert coroutine through the circuit breaker.
+    """
+    try:
+        _breaker.before_call()
+    except CircuitOpenError:
+        coro.close()
+        raise
+    
+    try:
+        result = _run(coro)
+    except Exception as exc:
+        # Only an unreachable or failing CloudConvert counts against the
+        # circuit; any other error means the service answered
+        if _is_transient(exc):
+            _breaker.record_failure()
+        else:
+            _breaker.record_success()
+        raise
+    _breaker.record_success()
+    return result
 
 
-def convert_cdr_to_pdf(caja_id, cdr_file_path):
+async def _create_job_and_upload(api_key, webhook_url, caja_id, storage, cdr_file_name, cdr_url=None):
     """
-    Convert CDR file to PDF using CloudConvert API and save to Caja instance.
+    Create the CloudConvert job and upload the CDR file to its import task.
+    
+    When ``cdr_url`` is given the job imports the file from that URL instead,
+    and nothing is uploaded.
+    
+    Returns:
+        str: ID of the created job
+    """
+    api_client = _client(api_key)
+
+    if cdr_url:
+        import_task = {
+            "operation": "import/url",
+            "url": cdr_url,
+            "filename": os.path.basename(cdr_file_name)
+        }
+    else:
+        import_task = {
+            "operation": "import/upload"
+        }
+
+    # Step 1: Create a job with import, convert, and export tasks.
+    # CloudConvert calls the webhook when the job finishes, so we tag the
+    # job with the Caja ID to find it again from the webhook payload.
+    job_data = {
+        "tag": str(caja_id),
+        "webhook_url": webhook_url,
+        "tasks": {
+            "import-cdr": import_task,
+            "convert-to-pdf": {
+                "operation": "convert",
+                "input": "import-cdr",
+                "output_format": "pdf",
+                "input_format": "cdr"
+            },
+            "export-pdf": {
+                "operation": "export/url",
+                "input": "convert-to-pdf"
+            }
+        }
+    }
+
+    # Create the job
+    response = await api_client.post("/jobs", json=job_data)
+    response.raise_for_status()
+    job = response.json()
+    job_id = job['data']['id']
+
+    if cdr_url:
+        return job_id
+
+    # Step 2: Find upload task and upload the CDR file
+    upload_task = None
+    for task in job['data']['tasks']:
+        if task['operation'] == 'import/upload' and task['status'] == 'waiting':
+            upload_task = task
+            break
+
+    if not upload_task:
+        raise ValueError("Upload task not found in job")
+
+    upload_url = upload_task['result']['form']['url']
+    upload_form_data = upload_task['result']['form']['parameters']
+
+    # Upload the CDR file; httpx streams the multipart body from the open handle.
+    # The upload URL is on another host, so it must not get the API key.
+    with storage.open(cdr_file_name, 'rb') as cdr_file:
+        files = {'file': (os.path.basename(cdr_file_name), cdr_file)}
+        upload_response = await _client().post(upload_url, data=upload_form_data, files=files)
+        upload_response.raise_for_status()
+
+    return job_id
+
+
+@shared_task(bind=True, **RETRY_POLICY)
+def start_conversion(self, caja_id, cdr_file_name):
+    """
+    Start a CloudConvert job converting the CDR file to PDF.
+
+    Creates the job and uploads the CDR file, then returns without waiting:
+    CloudConvert notifies ``cloudconvert_webhook`` when the job finishes.
+    Runs on a Celery worker; network errors are retried with backoff.
     
     Args:
         caja_id: ID of the Caja instance to update
-        cdr_file_path: Path to the CDR file to convert (relative to MEDIA_ROOT)
+        cdr_file_name: Storage name of the CDR file (e.g. ``cdr_files/caja.cdr``)
     """
     from .models import Caja
     
@@ -39,176 +268,89 @@ def convert_cdr_to_pdf(caja_id, cdr_file_path):
         # Get CloudConvert API key from settings
         api_key = getattr(settings, 'CLOUDCONVERT_API_KEY', None)
         if not api_key:
-            print(f"Error: CLOUDCONVERT_API_KEY not configured in settings")
+            logger.error("CLOUDCONVERT_API_KEY not configured in settings")
             return
         
-        # Get the full path to the CDR file
-        # cdr_file_path should already be an absolute path from Django's FileField.path
-        cdr_file_full_path = None
-        
-        if os.path.isabs(cdr_file_path):
-            # If absolute path provided, use it directly
-            if os.path.exists(cdr_file_path):
-                cdr_file_full_path = cdr_file_path
-            else:
-                # Try to extract filename and search in legacy location
-                filename = os.path.basename(cdr_file_path)
-                base_dir = getattr(settings, 'BASE_DIR', None)
-                if base_dir:
-                    legacy_path = os.path.join(str(base_dir), 'cdr_files', filename)
-                    if os.path.exists(legacy_path):
-                        cdr_file_full_path = legacy_path
-        else:
-            # If relative path provided, try MEDIA_ROOT first, then BASE_DIR
-            media_root = getattr(settings, 'MEDIA_ROOT', None)
-            base_dir = getattr(settings, 'BASE_DIR', None)
-            
-            # Try MEDIA_ROOT location
-            if media_root:
-                media_path = os.path.join(str(media_root), cdr_file_path)
-                if os.path.exists(media_path):
-                    cdr_file_full_path = media_path
-            
-            # Try BASE_DIR location (legacy, for files in project root)
-            if not cdr_file_full_path and base_dir:
-                # Extract just the filename or path relative to cdr_files/
-                if 'cdr_files/' in cdr_file_path:
-                    filename = os.path.basename(cdr_file_path)
-                    legacy_path = os.path.join(str(base_dir), 'cdr_files', filename)
-                else:
-                    legacy_path = os.path.join(str(base_dir), cdr_file_path)
-                
-                if os.path.exists(legacy_path):
-                    cdr_file_full_path = legacy_path
-        
-        if not cdr_file_full_path or not os.path.exists(cdr_file_full_path):
-            print(f"Error: CDR file not found")
-            print(f"  Searched path: {cdr_file_path}")
-            # List all attempted paths for debugging
-            attempted_paths = []
-            if os.path.isabs(cdr_file_path):
-                attempted_paths.append(cdr_file_path)
-            
-            media_root = getattr(settings, 'MEDIA_ROOT', None)
-            base_dir = getattr(settings, 'BASE_DIR', None)
-            
-            if media_root and not os.path.isabs(cdr_file_path):
-                attempted_paths.append(os.path.join(str(media_root), cdr_file_path))
-            if base_dir:
-                filename = os.path.basename(cdr_file_path)
-                attempted_paths.append(os.path.join(str(base_dir), 'cdr_files', filename))
-            
-            for path in attempted_paths:
-                print(f"  Tried: {path}")
+        webhook_url = getattr(settings, 'CLOUDCONVERT_WEBHOOK_URL', None)
+        if not webhook_url:
+            logger.error("CLOUDCONVERT_WEBHOOK_URL not configured in settings")
             return
         
-        # CloudConvert API base URL
-        api_base = "https://api.cloudconvert.com/v2"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Step 1: Create a job with import, convert, and export tasks
-        job_data = {
-            "tasks": {
-                "import-cdr": {
-                    "operation": "import/upload"
-                },
-                "convert-to-pdf": {
-                    "operation": "convert",
-                    "input": "import-cdr",
-                    "output_format": "pdf",
-                    "input_format": "cdr"
-                },
-                "export-pdf": {
-                    "operation": "export/url",
-                    "input": "convert-to-pdf"
-                }
-            }
-        }
-        
-        # Create the job
-        response = requests.post(f"{api_base}/jobs", json=job_data, headers=headers)
-        response.raise_for_status()
-        job = response.json()
-        job_id = job['data']['id']
-        
-        # Step 2: Find upload task and upload the CDR file
-        upload_task = None
-        for task in job['data']['tasks']:
-            if task['operation'] == 'import/upload' and task['status'] == 'waiting':
-                upload_task = task
-                break
-        
-        if not upload_task:
-            raise ValueError("Upload task not found in job")
-        
-        upload_url = upload_task['result']['form']['url']
-        upload_form_data = upload_task['result']['form']['parameters']
-        
-        # Upload the CDR file
-        with open(cdr_file_full_path, 'rb') as cdr_file:
-            files = {'file': (os.path.basename(cdr_file_path), cdr_file)}
-            upload_response = requests.post(upload_url, data=upload_form_data, files=files)
-            upload_response.raise_for_status()
-        
-        # Step 3: Poll for job completion
-        export_task_id = None
-        for task in job['data']['tasks']:
-            if task['operation'] == 'export/url':
-                export_task_id = task['id']
-                break
-        
-        if not export_task_id:
-            raise ValueError("Export task not found in job")
+        # Read the CDR file through its storage so any backend works
+        storage = Caja._meta.get_field('archivo_cdr').storage
+        if not storage.exists(cdr_file_name):
+            logger.error("CDR file not found in storage for Caja %s: %s", caja_id, cdr_file_name)
+            return
         
-        max_wait_time = 300  # 5 minutes
-        start_time = time.time()
+        # Remote storages (no local path) let CloudConvert fetch the file from
+        # its URL directly instead of streaming it through this worker
+        try:
+            storage.path(cdr_file_name)
+            cdr_url = None
+        except NotImplementedError:
+            cdr_url = storage.url(cdr_file_name)
         
-        while True:
-            status_response = requests.get(f"{api_base}/jobs/{job_id}", headers=headers)
-            status_response.raise_for_status()
-            job_status = status_response.json()['data']
-            
-            if job_status['status'] == 'finished':
-                break
-            elif job_status['status'] == 'error':
-                error_msg = job_status.get('message', 'Unknown error')
-                raise Exception(f"CloudConvert job failed: {error_msg}")
-            
-            if time.time() - start_time > max_wait_time:
-                raise TimeoutError("CloudConvert conversion timeout (exceeded 5 minutes)")
-            
-            time.sleep(2)  # Wait 2 seconds before polling again
+        job_id = _call_cloudconvert(_create_job_and_upload(api_key, webhook_url, caja_id, storage, cdr_file_name, cdr_url))
         
-        # Step 4: Find and download the converted PDF
-        export_task = None
-        for task in job_status['tasks']:
-            if task['id'] == export_task_id and task['status'] == 'finished':
-                export_task = task
-                break
+        logger.info("Started CloudConvert job %s for Caja %s", job_id, caja_id)
+        return job_id
         
-        if not export_task or 'result' not in export_task or 'files' not in export_task['result']:
-            raise ValueError("Export task not completed or no files found")
-        
-        pdf_url = export_task['result']['files'][0]['url']
-        pdf_response = requests.get(pdf_url)
+    except httpx.HTTPError as e:
+        if not _is_transient(e):
+            logger.error("CloudConvert rejected the request for Caja %s: %s", caja_id, e)
+            return
+        # Let Celery retry transient network errors
+        raise
+    except CircuitOpenError as e:
+        # CloudConvert is failing: retry once the circuit may have closed
+        raise self.retry(exc=e, countdown=e.retry_after)
+    except Exception:
+        logger.exception("Error starting CDR to PDF conversion for Caja %s", caja_id)
+
+
+async def _download_pdf(pdf_url, destination):
+    """
+    Stream the exported PDF from CloudConvert into an open binary file.
+    """
+    async with _client().stream("GET", pdf_url) as pdf_response:
         pdf_response.raise_for_status()
-        
-        # Step 5: Save PDF to Django storage and update Caja instance
-        pdf_filename = os.path.splitext(os.path.basename(cdr_file_path))[0] + '.pdf'
-        pdf_file = ContentFile(pdf_response.content, name=pdf_filename)
-        
-        # Update the Caja instance
+        async for chunk in pdf_response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            destination.write(chunk)
+
+
+@shared_task(bind=True, **RETRY_POLICY)
+def save_converted_pdf(self, caja_id, pdf_url, pdf_filename):
+    """
+    Download a converted PDF from CloudConvert and save it to the Caja instance.
+    
+    Args:
+        caja_id: ID of the Caja instance to update
+        pdf_url: Temporary CloudConvert URL of the exported PDF
+        pdf_filename: File name to store the PDF under
+    """
+    from .models import Caja
+    
+    try:
         caja = Caja.objects.get(pk=caja_id)
-        caja.archivo_pdf.save(f'pdf_files/{pdf_filename}', pdf_file, save=True)
         
-        print(f"Successfully converted CDR to PDF for Caja {caja_id}: {pdf_filename}")
+        # Stream the PDF to a temporary file instead of holding it in memory
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
+            _call_cloudconvert(_download_pdf(pdf_url, tmp))
+            tmp.seek(0)
+            
+            # Update the Caja instance
+            caja.archivo_pdf.save(f'pdf_files/{pdf_filename}', File(tmp, name=pdf_filename), save=True)
+        
+        logger.info("Successfully converted CDR to PDF for Caja %s: %s", caja_id, pdf_filename)
         
-    except Exception as e:
-        # Log error (in production, use proper logging)
-        print(f"Error converting CDR to PDF for Caja {caja_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-
+    except httpx.HTTPError as e:
+        if not _is_transient(e):
+            logger.error("CloudConvert rejected the request for Caja %s: %s", caja_id, e)
+            return
+        # Let Celery retry transient network errors
+        raise
+    except CircuitOpenError as e:
+        # CloudConvert is failing: retry once the circuit may have closed
+        raise self.retry(exc=e, countdown=e.retry_after)
+    except Exception:
+        logger.exception("Error saving converted PDF for Caja %s", caja_id)
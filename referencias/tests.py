@@ -1,3 +1,520 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import pdfplumber
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from scripts.get_bounding_box import _drawing_coords, get_bounding_box_mm
+
+from .models import Caja, Referencia, _medir_pdf
+from .tasks import API_BASE, CircuitBreaker, CircuitOpenError, _call_cloudconvert, _is_transient, start_conversion
+
+
+WEBHOOK_SECRET = 'test-secret'
+
+
+def _firmar(body):
+    return hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+@override_settings(CLOUDCONVERT_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class CloudConvertWebhookTests(TestCase):
+    def setUp(self):
+        self.url = reverse('cloudconvert_webhook')
+
+    def _post(self, payload, signature=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        if signature is None:
+            signature = _firmar(body)
+        return self.client.post(
+            self.url, body, content_type='application/json',
+            headers={'CloudConvert-Signature': signature},
+        )
+
+    def _job(self, event='job.finished', tasks=None):
+        if tasks is None:
+            tasks = [{
+                'operation': 'export/url',
+                'status': 'finished',
+                'result': {'files': [{'url': 'https://storage.example/caja.pdf', 'filename': 'caja.pdf'}]},
+            }]
+        return {'event': event, 'job': {'id': 'job-1', 'tag': '7', 'tasks': tasks}}
+
+    @mock.patch('referencias.views.save_converted_pdf')
+    def test_finished_job_queues_pdf_download(self, save_converted_pdf):
+        response = self._post(self._job())
+
+        self.assertEqual(response.status_code, 200)
+        save_converted_pdf.delay.assert_called_once_with(7, 'https://storage.example/caja.pdf', 'caja.pdf')
+
+    @mock.patch('referencias.views.save_converted_pdf')
+    def test_invalid_signature_is_rejected(self, save_converted_pdf):
+        response = self._post(self._job(), signature='0' * 64)
+
+        self.assertEqual(response.status_code, 403)
+        save_converted_pdf.delay.assert_not_called()
+
+    @mock.patch('referencias.views.save_converted_pdf')
+    def test_missing_signature_is_rejected(self, save_converted_pdf):
+        body = json.dumps(self._job()).encode()
+        response = self.client.post(self.url, body, content_type='application/json')
+
+        self.assertEqual(response.status_code, 403)
+        save_converted_pdf.delay.assert_not_called()
+
+    @mock.patch('referencias.views.save_converted_pdf')
+    def test_malformed_payload_is_rejected(self, save_converted_pdf):
+        for body in (b'not json', json.dumps({'event': 'job.finished'}).encode(),
+                     json.dumps({'event': 'job.finished', 'job': {'tag': 'abc'}}).encode()):
+            with self.subTest(body=body):
+                response = self._post(body)
+                self.assertEqual(response.status_code, 400)
+        save_converted_pdf.delay.assert_not_called()
+
+    @mock.patch('referencias.views.save_converted_pdf')
+    def test_failed_job_does_not_queue_download(self, save_converted_pdf):
+        response = self._post(self._job(event='job.failed'))
+
+        self.assertEqual(response.status_code, 200)
+        save_converted_pdf.delay.assert_not_called()
+
+    @mock.patch('referencias.views.save_converted_pdf')
+    def test_finished_job_without_files_does_not_queue_download(self, save_converted_pdf):
+        response = self._post(self._job(tasks=[{'operation': 'export/url', 'status': 'error'}]))
+
+        self.assertEqual(response.status_code, 200)
+        save_converted_pdf.delay.assert_not_called()
+
+    def test_only_post_is_allowed(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class CajaSaveTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        patcher = mock.patch('referencias.models.start_conversion')
+        self.start_conversion = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.referencia = Referencia.objects.create(nombre='Ecommerce', foto='fotos/caja.jpg')
+
+    def _crear_caja(self, contenido=b'CDR v1'):
+        caja = Caja(referencia=self.referencia, ancho_cm=10, alto_cm=20, profundidad_cm=5)
+        caja.archivo_cdr = SimpleUploadedFile('caja.cdr', contenido)
+        with self.captureOnCommitCallbacks(execute=True):
+            caja.save()
+        self.start_conversion.delay.reset_mock()
+        return Caja.objects.get(pk=caja.pk)
+
+    def _guardar(self, caja):
+        with self.captureOnCommitCallbacks(execute=True):
+            caja.save()
+
+    def test_new_upload_queues_conversion(self):
+        caja = Caja(referencia=self.referencia, ancho_cm=10, alto_cm=20, profundidad_cm=5)
+        caja.archivo_cdr = SimpleUploadedFile('caja.cdr', b'CDR v1')
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_called_once_with(caja.pk, caja.archivo_cdr.name)
+        self.assertTrue(caja.archivo_cdr_etag)
+
+    def test_reupload_with_same_content_does_not_convert(self):
+        caja = self._crear_caja()
+        caja.archivo_pdf = caja.archivo_pdf.storage.save('pdf_files/caja.pdf', ContentFile(b'%PDF'))
+        self._guardar(caja)
+        etag = caja.archivo_cdr_etag
+
+        caja.archivo_cdr = SimpleUploadedFile('caja.cdr', b'CDR v1')
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_not_called()
+        self.assertEqual(caja.archivo_cdr_etag, etag)
+
+    def test_reupload_with_same_content_and_no_pdf_converts(self):
+        # The first conversion never produced a PDF; uploading the file again retries it
+        caja = self._crear_caja()
+        etag = caja.archivo_cdr_etag
+
+        caja.archivo_cdr = SimpleUploadedFile('caja.cdr', b'CDR v1')
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_called_once_with(caja.pk, caja.archivo_cdr.name)
+        self.assertEqual(caja.archivo_cdr_etag, etag)
+
+    def test_reupload_with_changed_content_converts(self):
+        caja = self._crear_caja()
+        etag = caja.archivo_cdr_etag
+
+        caja.archivo_cdr = SimpleUploadedFile('caja.cdr', b'CDR v2')
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_called_once_with(caja.pk, caja.archivo_cdr.name)
+        self.assertNotEqual(caja.archivo_cdr_etag, etag)
+
+    def test_saving_other_fields_does_not_convert(self):
+        caja = self._crear_caja()
+
+        caja.ancho_cm += 1
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_not_called()
+
+    def test_switching_to_another_stored_file_converts(self):
+        caja = self._crear_caja()
+        etag = caja.archivo_cdr_etag
+        otro = caja.archivo_cdr.storage.save('cdr_files/otra.cdr', ContentFile(b'otro CDR'))
+
+        caja.archivo_cdr = otro
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_called_once_with(caja.pk, otro)
+        self.assertNotEqual(caja.archivo_cdr_etag, etag)
+
+    def test_existing_row_with_missing_file_saves(self):
+        caja = self._crear_caja()
+        Caja.objects.filter(pk=caja.pk).update(archivo_cdr='cdr_files/no_existe.cdr', archivo_cdr_etag='')
+        caja = Caja.objects.get(pk=caja.pk)
+
+        caja.ancho_cm += 1
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_not_called()
+        self.assertEqual(caja.archivo_cdr_etag, '')
+        self.assertEqual(Caja.objects.get(pk=caja.pk).ancho_cm, 11)
+
+    def test_failed_enqueue_clears_fingerprint(self):
+        caja = Caja(referencia=self.referencia, ancho_cm=10, alto_cm=20, profundidad_cm=5)
+        caja.archivo_cdr = SimpleUploadedFile('caja.cdr', b'CDR v1')
+        self.start_conversion.delay.side_effect = ConnectionError('broker down')
+
+        with self.assertLogs('referencias.models', 'ERROR'):
+            self._guardar(caja)
+
+        self.assertEqual(Caja.objects.get(pk=caja.pk).archivo_cdr_etag, '')
+
+    def test_missing_fingerprint_is_backfilled_without_converting(self):
+        caja = self._crear_caja()
+        Caja.objects.filter(pk=caja.pk).update(archivo_cdr_etag='')
+        caja = Caja.objects.get(pk=caja.pk)
+
+        self._guardar(caja)
+
+        self.start_conversion.delay.assert_not_called()
+        self.assertTrue(caja.archivo_cdr_etag)
+
+
+class MedirPdfTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def _caja_con_pdf(self, contenido):
+        caja = Caja()
+        caja.archivo_pdf = caja.archivo_pdf.storage.save('pdf_files/caja.pdf', ContentFile(contenido))
+        return caja
+
+    @mock.patch('referencias.models.get_bounding_box_mm', return_value=(876.0, 653.0))
+    def test_same_pdf_is_parsed_once(self, get_bounding_box_mm):
+        caja = self._caja_con_pdf(b'%PDF v1')
+
+        self.assertEqual(_medir_pdf(caja.archivo_pdf), (876.0, 653.0))
+        self.assertEqual(_medir_pdf(caja.archivo_pdf), (876.0, 653.0))
+
+        get_bounding_box_mm.assert_called_once_with(caja.archivo_pdf.path)
+
+    @mock.patch('referencias.models.get_bounding_box_mm', return_value=(876.0, 653.0))
+    def test_changed_pdf_is_parsed_again(self, get_bounding_box_mm):
+        _medir_pdf(self._caja_con_pdf(b'%PDF v1').archivo_pdf)
+        _medir_pdf(self._caja_con_pdf(b'%PDF v2').archivo_pdf)
+
+        self.assertEqual(get_bounding_box_mm.call_count, 2)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('referencias.tasks.time.monotonic', return_value=1000.0)
+        self.monotonic = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(fail_max=2, reset_timeout=60)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+
+        with self.assertRaises(CircuitOpenError) as cm:
+            self.breaker.before_call()
+        self.assertEqual(cm.exception.retry_after, 60)
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.breaker.before_call()
+
+    def test_half_open_lets_a_single_trial_through(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.monotonic.return_value += 61
+
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_successful_trial_closes_the_circuit(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.monotonic.return_value += 61
+
+        self.breaker.before_call()
+        self.breaker.record_success()
+
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+    def test_failed_trial_reopens_the_circuit(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.monotonic.return_value += 61
+
+        self.breaker.before_call()
+        self.breaker.record_failure()
+
+        with self.assertRaises(CircuitOpenError) as cm:
+            self.breaker.before_call()
+        self.assertEqual(cm.exception.retry_after, 60)
+
+
+def _status_error(status_code):
+    request = httpx.Request('GET', 'https://api.cloudconvert.com/v2/jobs')
+    response = httpx.Response(status_code, request=request)
+    return httpx.HTTPStatusError('error', request=request, response=response)
+
+
+class CallCloudConvertTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('referencias.tasks._breaker', CircuitBreaker(fail_max=2, reset_timeout=60))
+        self.breaker = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fallar(self, exc):
+        async def llamada():
+            raise exc
+
+        with self.assertRaises(type(exc)):
+            _call_cloudconvert(llamada())
+
+    def test_transient_errors(self):
+        self.assertTrue(_is_transient(httpx.ConnectError('refused')))
+        self.assertTrue(_is_transient(_status_error(503)))
+        self.assertFalse(_is_transient(_status_error(404)))
+        self.assertFalse(_is_transient(ValueError('no upload task')))
+
+    def test_client_errors_do_not_open_the_circuit(self):
+        for _ in range(5):
+            self._fallar(_status_error(404))
+
+        self.breaker.before_call()
+
+    def test_server_errors_open_the_circuit(self):
+        self._fallar(_status_error(502))
+        self._fallar(httpx.ConnectError('refused'))
+
+        async def llamada():
+            return 'ok'
+
+        coro = llamada()
+        with self.assertRaises(CircuitOpenError):
+            _call_cloudconvert(coro)
+
+
+class BoundingBoxTests(SimpleTestCase):
+    pdf_path = settings.BASE_DIR / 'pdf_files' / 'caja_ecommerce.pdf'
+
+    def setUp(self):
+        _drawing_coords.cache_clear()
+        self.addCleanup(_drawing_coords.cache_clear)
+
+    def test_caja_ecommerce_bounding_box(self):
+        self.assertEqual(get_bounding_box_mm(self.pdf_path), (876.0, 653.0))
+
+    @mock.patch('scripts.get_bounding_box.pdfplumber.open')
+    def test_pdf_without_drawing_objects(self, pdfplumber_open):
+        page = mock.Mock(curves=[], lines=[], rects=[])
+        pdfplumber_open.return_value.__enter__.return_value.pages = [page]
+
+        self.assertEqual(get_bounding_box_mm(self.pdf_path), (None, None))
+
+    def test_modified_file_is_parsed_again(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        pdf_path = os.path.join(tmp_dir, 'caja.pdf')
+        shutil.copyfile(self.pdf_path, pdf_path)
+
+        with mock.patch('scripts.get_bounding_box.pdfplumber.open', wraps=pdfplumber.open) as pdfplumber_open:
+            get_bounding_box_mm(pdf_path)
+            get_bounding_box_mm(pdf_path)
+            self.assertEqual(pdfplumber_open.call_count, 1)
+
+            # Same size, new modification time
+            stat = os.stat(pdf_path)
+            os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            get_bounding_box_mm(pdf_path)
+            self.assertEqual(pdfplumber_open.call_count, 2)
+
+            # Same modification time, new size
+            stat = os.stat(pdf_path)
+            with open(pdf_path, 'ab') as pdf:
+                pdf.write(b'\n')
+            os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            self.assertEqual(get_bounding_box_mm(pdf_path), (876.0, 653.0))
+            self.assertEqual(pdfplumber_open.call_count, 3)
+
+
+class RemoteStorage(FileSystemStorage):
+    """Storage sin rutas locales, como los de S3 o GCS."""
+
+    def path(self, name):
+        raise NotImplementedError("This backend doesn't support absolute paths.")
+
+
+@override_settings(CLOUDCONVERT_API_KEY='api-key', CLOUDCONVERT_WEBHOOK_URL='https://todocajas.example/cloudconvert/webhook/')
+class StartConversionTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        patcher = mock.patch('referencias.tasks._breaker', CircuitBreaker(fail_max=2, reset_timeout=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.requests = []
+        transport = httpx.MockTransport(self._responder)
+        patcher = mock.patch(
+            'referencias.tasks._client',
+            lambda api_key=None: httpx.AsyncClient(transport=transport, base_url=API_BASE),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _responder(self, request):
+        self.requests.append(request)
+        if request.url.host == 'upload.example':
+            return httpx.Response(201)
+        job = json.loads(request.content)
+        tasks = [{'operation': task['operation'], 'status': 'waiting'} for task in job['tasks'].values()]
+        for task in tasks:
+            if task['operation'] == 'import/upload':
+                task['result'] = {'form': {'url': 'https://upload.example/', 'parameters': {'key': 'abc'}}}
+        return httpx.Response(201, json={'data': {'id': 'job-1', 'tasks': tasks}})
+
+    def _convertir(self, storage):
+        name = storage.save('cdr_files/caja.cdr', ContentFile(b'CDR v1'))
+        with mock.patch.object(Caja._meta.get_field('archivo_cdr'), 'storage', storage):
+            return start_conversion(7, name)
+
+    def test_remote_storage_imports_from_url(self):
+        storage = RemoteStorage(location=self.media_root, base_url='https://cdn.example/media/')
+
+        self.assertEqual(self._convertir(storage), 'job-1')
+
+        self.assertEqual(len(self.requests), 1)
+        job = json.loads(self.requests[0].content)
+        self.assertEqual(job['tag'], '7')
+        self.assertEqual(job['tasks']['import-cdr'], {
+            'operation': 'import/url',
+            'url': 'https://cdn.example/media/cdr_files/caja.cdr',
+            'filename': 'caja.cdr',
+        })
+
+    def test_local_storage_uploads_the_file(self):
+        storage = FileSystemStorage(location=self.media_root)
+
+        self.assertEqual(self._convertir(storage), 'job-1')
+
+        self.assertEqual([request.url.host for request in self.requests], ['api.cloudconvert.com', 'upload.example'])
+        job = json.loads(self.requests[0].content)
+        self.assertEqual(job['tasks']['import-cdr'], {'operation': 'import/upload'})
+        self.assertIn(b'CDR v1', self.requests[1].read())
+
+
+def _medir_pdf_falso(field_file):
+    if field_file.name == 'pdf_files/mala.pdf':
+        raise ValueError('PDF dañado')
+    return 100.0, 50.0
+
+
+@mock.patch('referencias.models._medir_pdf', side_effect=_medir_pdf_falso)
+class RecalcularAnchoAlto2dTests(TestCase):
+    def setUp(self):
+        referencia = Referencia.objects.create(nombre='Ecommerce', foto='fotos/caja.jpg')
+        self.buena, self.mala, self.sin_pdf = Caja.objects.bulk_create([
+            Caja(referencia=referencia, ancho_cm=10, alto_cm=20, profundidad_cm=5,
+                 archivo_cdr='cdr_files/buena.cdr', archivo_pdf='pdf_files/buena.pdf'),
+            Caja(referencia=referencia, ancho_cm=10, alto_cm=30, profundidad_cm=5,
+                 archivo_cdr='cdr_files/mala.cdr', archivo_pdf='pdf_files/mala.pdf'),
+            Caja(referencia=referencia, ancho_cm=10, alto_cm=40, profundidad_cm=5,
+                 archivo_cdr='cdr_files/sin_pdf.cdr'),
+        ])
+
+    def test_failing_pdf_is_skipped_and_reported(self, medir_pdf):
+        with mock.patch.object(Caja.objects, 'bulk_update', wraps=Caja.objects.bulk_update) as bulk_update:
+            actualizadas, fallidas = Caja.objects.recalcular_ancho_alto_2d()
+
+        self.assertEqual(actualizadas, 1)
+        self.assertEqual([pk for pk, error in fallidas], [self.mala.pk])
+        self.assertIsInstance(fallidas[0][1], ValueError)
+        bulk_update.assert_called_once()
+        self.assertEqual(medir_pdf.call_count, 2)
+
+        self.buena.refresh_from_db()
+        self.assertEqual((self.buena.ancho_2d_mm, self.buena.alto_2d_mm), (100.0, 50.0))
+        self.mala.refresh_from_db()
+        self.assertIsNone(self.mala.ancho_2d_mm)
+
+    def test_command_reports_failures(self, medir_pdf):
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command('recalcular_2d', '--workers', '2', stdout=stdout, stderr=stderr)
+
+        self.assertIn('1 cajas actualizadas', stdout.getvalue())
+        self.assertIn(f'Caja {self.mala.pk}: PDF dañado', stderr.getvalue())
+
+    def test_command_limits_to_given_ids(self, medir_pdf):
+        stdout = StringIO()
+
+        call_command('recalcular_2d', str(self.buena.pk), stdout=stdout, stderr=StringIO())
+
+        self.assertIn('1 cajas actualizadas', stdout.getvalue())
+        medir_pdf.assert_called_once()
+
+    def test_command_rejects_zero_workers(self, medir_pdf):
+        with self.assertRaises(CommandError):
+            call_command('recalcular_2d', '--workers', '0')
+        medir_pdf.assert_not_called()
@@ -1,3 +1,69 @@
-from django.shortcuts import render
+import hashlib
+import hmac
+import json
+import logging
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .tasks import save_converted_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def _firma_valida(request):
+    """
+    Verifica la firma HMAC-SHA256 que CloudConvert envía en cada webhook.
+    """
+    secret = getattr(settings, 'CLOUDCONVERT_WEBHOOK_SECRET', None)
+    signature = request.headers.get('CloudConvert-Signature', '')
+    if not secret or not signature:
+        return False
+
+    expected = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+@csrf_exempt
+@require_POST
+def cloudconvert_webhook(request):
+    """
+    Recibe los eventos job.finished / job.failed de CloudConvert.
+
+    Cuando el trabajo termina, encola la descarga del PDF para la Caja
+    indicada en el tag del trabajo.
+    """
+    if not _firma_valida(request):
+        return HttpResponseForbidden("Invalid signature")
+
+    try:
+        payload = json.loads(request.body)
+        event = payload['event']
+        job = payload['job']
+        caja_id = int(job['tag'])
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest("Invalid payload")
+
+    if event == 'job.failed':
+        logger.error("CloudConvert job %s failed for Caja %s: %s", job.get('id'), caja_id, job.get('message', 'Unknown error'))
+        return HttpResponse(status=200)
+
+    if event != 'job.finished':
+        return HttpResponse(status=200)
+
+    # Find the exported PDF
+    export_task = None
+    for task in job.get('tasks', []):
+        if task.get('operation') == 'export/url' and task.get('status') == 'finished':
+            export_task = task
+            break
+
+    if not export_task or not export_task.get('result', {}).get('files'):
+        logger.error("CloudConvert job %s finished without exported files for Caja %s", job.get('id'), caja_id)
+        return HttpResponse(status=200)
+
+    pdf = export_task['result']['files'][0]
+    save_converted_pdf.delay(caja_id, pdf['url'], pdf['filename'])
+    return HttpResponse(status=200)
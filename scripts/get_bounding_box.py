@@ -3,34 +3,78 @@
 Extract bounding box dimensions from PDF figure
 """
 
+import functools
+import itertools
+import os
 import sys
-from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
 import pdfplumber
-from pypdf import PdfReader
 
-def get_pdf_dimensions(pdf_path):
-    """Extract page size and object bounding boxes from PDF"""
+# 1 point = 1/72 inch, 1 inch = 25.4 mm
+PT_TO_MM = 25.4 / 72.0
+
+def _soa(objs):
+    """
+    Coordinates of pdfplumber objects as an (N, 4) float array.
     
-    # Get page dimensions using pypdf
-    reader = PdfReader(pdf_path)
-    page = reader.pages[0]
+    Columns are x0, x1, top and bottom. Each field is read once, straight
+    into the array, without building intermediate lists.
+    """
+    return np.fromiter(
+        itertools.chain.from_iterable((obj['x0'], obj['x1'], obj['top'], obj['bottom']) for obj in objs),
+        dtype=np.float64,
+        count=4 * len(objs),
+    ).reshape(len(objs), 4)
+
+def _page_coords(page):
+    """(N, 4) coordinate array of all curves, lines and rectangles of a page"""
+    return np.vstack([_soa(page.curves), _soa(page.lines), _soa(page.rects)])
+
+@functools.lru_cache(maxsize=32)
+def _drawing_coords(pdf_path, mtime_ns, size):
+    """
+    Coordinate array of the first page's drawing objects, cached per file.
     
-    # Get MediaBox (page dimensions in points, 1 point = 1/72 inch)
-    mediabox = page.mediabox
-    page_width = float(mediabox.width)
-    page_height = float(mediabox.height)
+    ``mtime_ns`` and ``size`` are only part of the cache key, so a modified
+    file is parsed again. The cached array is read-only.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        first_page = pdf.pages[0]
+        coords = _page_coords(first_page)
+        first_page.flush_cache()
     
-    print("=" * 60)
-    print("PDF PAGE DIMENSIONS")
-    print("=" * 60)
-    print(f"Page Width:  {page_width:.2f} points = {page_width/72:.2f} inches = {page_width/72*25.4:.2f} mm")
-    print(f"Page Height: {page_height:.2f} points = {page_height/72:.2f} inches = {page_height/72*25.4:.2f} mm")
-    print()
+    coords.flags.writeable = False
+    return coords
+
+def _bounding_box_pt(coords):
+    """
+    Bounding box of a coordinate array, in points.
+    
+    Returns:
+        tuple: (min_x, min_y, max_x, max_y)
+    """
+    x_coords = coords[:, :2]
+    y_coords = coords[:, 2:]
+    return float(x_coords.min()), float(y_coords.min()), float(x_coords.max()), float(y_coords.max())
+
+def get_pdf_dimensions(pdf_path):
+    """Extract page size and object bounding boxes from PDF"""
     
-    # Use pdfplumber to extract objects
+    # Use pdfplumber for both the page size and the objects (single parse)
     with pdfplumber.open(pdf_path) as pdf:
         first_page = pdf.pages[0]
         
+        # Page dimensions in points, 1 point = 1/72 inch
+        page_width = float(first_page.width)
+        page_height = float(first_page.height)
+        
+        print("=" * 60)
+        print("PDF PAGE DIMENSIONS")
+        print("=" * 60)
+        print(f"Page Width:  {page_width:.2f} points = {page_width/72:.2f} inches = {page_width/72*25.4:.2f} mm")
+        print(f"Page Height: {page_height:.2f} points = {page_height/72:.2f} inches = {page_height/72*25.4:.2f} mm")
+        print()
+        
         # Get all curves/lines (the drawing paths)
         curves = first_page.curves
         rects = first_page.rects
@@ -46,50 +90,28 @@ def get_pdf_dimensions(pdf_path):
         
         # Calculate bounding box of all drawing objects
         if curves or lines or rects:
-            all_objects = []
+            min_x, min_y, max_x, max_y = _bounding_box_pt(_page_coords(first_page))
             
-            # Collect all coordinates
-            for curve in curves:
-                all_objects.append((curve['x0'], curve['top']))
-                all_objects.append((curve['x1'], curve['bottom']))
+            bbox_width = max_x - min_x
+            bbox_height = max_y - min_y
             
-            for line in lines:
-                all_objects.append((line['x0'], line['top']))
-                all_objects.append((line['x1'], line['bottom']))
-                
-            for rect in rects:
-                all_objects.append((rect['x0'], rect['top']))
-                all_objects.append((rect['x1'], rect['bottom']))
+            print("=" * 60)
+            print("BOUNDING BOX OF FIGURE")
+            print("=" * 60)
+            print(f"X range: {min_x:.2f} to {max_x:.2f}")
+            print(f"Y range: {min_y:.2f} to {max_y:.2f}")
+            print()
+            print(f"WIDTH:  {bbox_width:.2f} points = {bbox_width/72:.2f} inches = {bbox_width/72*25.4:.2f} mm")
+            print(f"HEIGHT: {bbox_height:.2f} points = {bbox_height/72:.2f} inches = {bbox_height/72*25.4:.2f} mm")
+            print()
+            print("=" * 60)
+            print("SUMMARY")
+            print("=" * 60)
+            print(f"Figure Width:  {bbox_width:.2f} pt | {bbox_width/72:.4f} in | {bbox_width/72*25.4:.2f} mm")
+            print(f"Figure Height: {bbox_height:.2f} pt | {bbox_height/72:.4f} in | {bbox_height/72*25.4:.2f} mm")
+            print(f"Aspect Ratio:  {bbox_width/bbox_height:.3f}")
             
-            if all_objects:
-                x_coords = [obj[0] for obj in all_objects]
-                y_coords = [obj[1] for obj in all_objects]
-                
-                min_x = min(x_coords)
-                max_x = max(x_coords)
-                min_y = min(y_coords)
-                max_y = max(y_coords)
-                
-                bbox_width = max_x - min_x
-                bbox_height = max_y - min_y
-                
-                print("=" * 60)
-                print("BOUNDING BOX OF FIGURE")
-                print("=" * 60)
-                print(f"X range: {min_x:.2f} to {max_x:.2f}")
-                print(f"Y range: {min_y:.2f} to {max_y:.2f}")
-                print()
-                print(f"WIDTH:  {bbox_width:.2f} points = {bbox_width/72:.2f} inches = {bbox_width/72*25.4:.2f} mm")
-                print(f"HEIGHT: {bbox_height:.2f} points = {bbox_height/72:.2f} inches = {bbox_height/72*25.4:.2f} mm")
-                print()
-                print("=" * 60)
-                print("SUMMARY")
-                print("=" * 60)
-                print(f"Figure Width:  {bbox_width:.2f} pt | {bbox_width/72:.4f} in | {bbox_width/72*25.4:.2f} mm")
-                print(f"Figure Height: {bbox_height:.2f} pt | {bbox_height/72:.4f} in | {bbox_height/72*25.4:.2f} mm")
-                print(f"Aspect Ratio:  {bbox_width/bbox_height:.3f}")
-                
-                return bbox_width, bbox_height
+            return bbox_width, bbox_height
 
 def get_bounding_box_mm(pdf_path):
     """
@@ -102,55 +124,21 @@ def get_bounding_box_mm(pdf_path):
         tuple: (width_mm, height_mm) - Width and height in millimeters
                Returns (None, None) if no objects found
     """
-    with pdfplumber.open(pdf_path) as pdf:
-        first_page = pdf.pages[0]
+    # Coordinates of all curves/lines/rectangles (the drawing paths)
+    stat = os.stat(pdf_path)
+    coords = _drawing_coords(os.fspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    
+    # Calculate bounding box of all drawing objects
+    if len(coords):
+        min_x, min_y, max_x, max_y = _bounding_box_pt(coords)
         
-        # Get all curves/lines/rectangles (the drawing paths)
-        curves = first_page.curves
-        rects = first_page.rects
-        lines = first_page.lines
+        # Calculate width and height in points
+        bbox_width_pt = max_x - min_x
+        bbox_height_pt = max_y - min_y
         
-        # Calculate bounding box of all drawing objects
-        if curves or lines or rects:
-            all_objects = []
-            
-            # Collect all coordinates
-            for curve in curves:
-                all_objects.append((curve['x0'], curve['top']))
-                all_objects.append((curve['x1'], curve['bottom']))
-            
-            for line in lines:
-                all_objects.append((line['x0'], line['top']))
-                all_objects.append((line['x1'], line['bottom']))
-                
-            for rect in rects:
-                all_objects.append((rect['x0'], rect['top']))
-                all_objects.append((rect['x1'], rect['bottom']))
-            
-            if all_objects:
-                x_coords = [obj[0] for obj in all_objects]
-                y_coords = [obj[1] for obj in all_objects]
-                
-                min_x = min(x_coords)
-                max_x = max(x_coords)
-                min_y = min(y_coords)
-                max_y = max(y_coords)
-                
-                # Calculate width and height in points
-                bbox_width_pt = max_x - min_x
-                bbox_height_pt = max_y - min_y
-                
-                # Convert to millimeters (1 point = 1/72 inch, 1 inch = 25.4 mm)
-                # Use Decimal with 1 decimal place precision
-                width_mm = (Decimal(str(bbox_width_pt)) / Decimal('72')) * Decimal('25.4')
-                height_mm = (Decimal(str(bbox_height_pt)) / Decimal('72')) * Decimal('25.4')
-                
-                # Round to 1 decimal place
-                width_mm = width_mm.quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
-                height_mm = height_mm.quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
-                
-                return float(width_mm), float(height_mm)
-    
+        # Convert to millimeters, rounded to 1 decimal place
+        return round(bbox_width_pt * PT_TO_MM, 1), round(bbox_height_pt * PT_TO_MM, 1)
+
     return None, None
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+"""
+Celery application for todocajas.
+
+Start a worker with:
+
+    celery -A todocajas worker -l info
+
+For more information on this file, see
+https://docs.celeryq.dev/en/stable/django/first-steps-with-django.html
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'todocajas.settings')
+
+app = Celery('todocajas')
+
+# All Celery settings live in Django settings under the CELERY_ prefix.
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
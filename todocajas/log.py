@@ -0,0 +1,39 @@
+"""
+Logging handlers for todocajas.
+
+``BackgroundQueueHandler`` only puts records on a queue; a listener thread
+writes them to stderr, so logging never blocks a request or a task on I/O.
+It is configured in ``LOGGING`` in settings.py.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler with its own QueueListener writing to stderr.
+
+    Records are formatted by this handler before being queued, so the
+    listener only writes the final message.
+    """
+
+    def __init__(self):
+        super().__init__(queue.SimpleQueue())
+        self._target = logging.StreamHandler()
+        self._pid = None
+
+    def enqueue(self, record):
+        # Threads do not survive fork (e.g. Celery prefork workers), so each
+        # process starts its own listener on first use. Handler.handle() holds
+        # the handler lock here, so only one thread gets to start it.
+        if self._pid != os.getpid():
+            self.queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(self.queue, self._target)
+            listener.start()
+            atexit.register(listener.stop)
+            self._pid = os.getpid()
+        super().enqueue(record)
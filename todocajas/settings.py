@@ -127,6 +127,47 @@ MEDIA_URL = '/media/'
 # CloudConvert API Configuration
 # Get your API key from https://cloudconvert.com/dashboard/api
 CLOUDCONVERT_API_KEY = os.getenv('CLOUDCONVERT_API_KEY')
+# Public URL of the cloudconvert_webhook view and its signing secret
+# (https://cloudconvert.com/dashboard/api/v2/webhooks)
+CLOUDCONVERT_WEBHOOK_URL = os.getenv('CLOUDCONVERT_WEBHOOK_URL')
+CLOUDCONVERT_WEBHOOK_SECRET = os.getenv('CLOUDCONVERT_WEBHOOK_SECRET')
+
+# Celery Configuration
+# https://docs.celeryq.dev/en/stable/userguide/configuration.html
+
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_WORKER_CONCURRENCY = 4
+# Acknowledge after the task runs so a worker restart does not lose a conversion
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Logging
+# https://docs.djangoproject.com/en/4.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {
+            'format': '{asctime} {levelname} {name} {process:d} {thread:d} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        # Hands records to a background thread so logging never blocks
+        'queue': {
+            '()': 'todocajas.log.BackgroundQueueHandler',
+            'formatter': 'verbose',
+        },
+    },
+    'loggers': {
+        'referencias': {
+            'handlers': ['queue'],
+            'level': os.getenv('REFERENCIAS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
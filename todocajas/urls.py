@@ -17,6 +17,9 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from referencias import views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('cloudconvert/webhook/', views.cloudconvert_webhook, name='cloudconvert_webhook'),
 ]